@@ -14,11 +14,14 @@ Notes:
 """
 
 import asyncio
+import heapq
+import logging
 import time
-from collections import deque, defaultdict
-import requests
+from operator import itemgetter
+import aiohttp
 import os
-import traceback
+
+logger = logging.getLogger(__name__)
 
 # Read credentials from environment variables (do NOT put real tokens in the repo)
 QUOTEX_EMAIL = os.getenv("QUOTEX_EMAIL")
@@ -30,46 +33,115 @@ if not all([QUOTEX_EMAIL, QUOTEX_PASSWORD, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID]
     print("WARNING: One or more required environment variables are missing.")
     print("Set QUOTEX_EMAIL, QUOTEX_PASSWORD, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID in your host.")
 
+# Telegram endpoint and payload template are fixed for the process lifetime
+_TG_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage" if TELEGRAM_BOT_TOKEN else None
+_tg_template = {"chat_id": TELEGRAM_CHAT_ID}
+
 # Config (can be overridden via env)
 TIMEFRAME = int(os.getenv("TIMEFRAME", 60))            # 1-minute candles
 COOLDOWN_SECONDS = int(os.getenv("COOLDOWN_SECONDS", 300))  # 5 minutes default cooldown per asset
-POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", 1.0))      # loop sleep seconds
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", 5.0))      # retry delay while a candle is late
+LATE_RETRIES = int(os.getenv("LATE_RETRIES", 3))            # max retries per candle for late/failed assets
+
+
+def _select_clock():
+    """
+    Pick the clock used for cooldowns. monotonic is preferred, but on platforms where it is
+    tick-based (e.g. ~15.6 ms on Windows) perf_counter usually has finer resolution.
+    """
+    info = time.get_clock_info("monotonic")
+    print("Monotonic clock:", info)
+    if info.resolution >= 0.015:
+        print("WARNING: monotonic clock is coarse; using perf_counter for cooldowns.")
+        return time.perf_counter
+    return time.monotonic
 
-last_alert_time = defaultdict(lambda: 0)
-recent_colors = defaultdict(lambda: deque(maxlen=4))  # keep last 4 closed candles
 
+_now = _select_clock()
 
-def send_telegram(text: str):
+last_alert_time: dict[str, float] = {}  # _now() time of last alert per asset
+recent_colors: dict[str, tuple[str, int]] = {}  # (last color, same-color streak) per asset
+
+# Shared HTTP session for Telegram; created inside monitor() so it binds to the running loop
+_tg_session: aiohttp.ClientSession | None = None
+# Strong references to in-flight alert tasks so they are not garbage collected mid-send
+_background_tasks = set()
+
+
+async def send_telegram(text: str):
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         print("Telegram credentials not set. Skipping telegram send. Message would be:", text)
         return
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text}
+    if _tg_session is None:
+        print("Telegram session not started (send_telegram called outside monitor()). Message would be:", text)
+        return
+    payload = _tg_template | {"text": text}
     try:
-        r = requests.post(url, json=payload, timeout=10)
-        r.raise_for_status()
+        async with _tg_session.post(_TG_URL, json=payload) as r:
+            r.raise_for_status()
     except Exception as e:
-        print("Telegram send error:", e)
+        logger.warning("Telegram send error: %r", e)
 
 
-def candle_color(candle):
+def schedule_telegram(text: str):
+    """
+    Fire-and-forget send_telegram so the polling cadence is not tied to Telegram latency.
+    """
+    task = asyncio.create_task(send_telegram(text))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+# Per-asset (open_key, close_key) detected on the first candle of each feed
+_key_cache: dict[str, tuple[str, str]] = {}
+
+
+def _probe_candle_keys(candle):
+    open_key = next((k for k in ("open", "o", "O") if k in candle), None)
+    close_key = next((k for k in ("close", "c", "C") if k in candle), None)
+    if open_key is None or close_key is None:
+        return None
+    return open_key, close_key
+
+
+def candle_color(candle, asset=None):
     """
     Uniformly determine candle color from common candle dict keys.
+    The key variant used by the feed is detected once per asset and cached.
     Returns: 'green', 'red', or 'doji'
     """
-    try:
-        o = float(candle.get("open") or candle.get("o") or candle.get("O"))
-        c = float(candle.get("close") or candle.get("c") or candle.get("C"))
-        if c > o:
-            return "green"
-        elif c < o:
-            return "red"
-        else:
+    keys = _key_cache.get(asset)
+    if keys is None:
+        try:
+            keys = _probe_candle_keys(candle)
+        except Exception:
+            keys = None
+        if keys is None:
             return "doji"
+        _key_cache[asset] = keys
+
+    open_key, close_key = keys
+    try:
+        o = float(candle[open_key])
+        c = float(candle[close_key])
+        return "green" if c > o else ("red" if c < o else "doji")
+    except KeyError:
+        # feed changed its key variant; detect again on the next candle
+        _key_cache.pop(asset, None)
+        return "doji"
     except Exception:
         return "doji"
 
 
+def _instrument_payments(instruments):
+    """Yield (code, payment) for each instrument row, skipping malformed rows."""
+    for i in instruments:
+        try:
+            yield i[1], float(i[5]) if i[5] not in (None, "") else 0.0
+        except Exception:
+            continue
+
+
 async def pick_top_3_assets(qx):
     """
     Try to pick top 3 assets by payout if available; otherwise fallback to first 3 codes.
@@ -78,19 +150,11 @@ async def pick_top_3_assets(qx):
     try:
         instruments = getattr(qx.api, "instruments", None)
         if instruments:
-            pairs = []
-            for i in instruments:
-                try:
-                    code = i[1]
-                    payment = float(i[5]) if i[5] not in (None, "") else 0.0
-                    pairs.append((code, payment))
-                except Exception:
-                    continue
-            if pairs:
-                pairs.sort(key=lambda x: x[1], reverse=True)
-                return [p for p, _ in pairs[:3]]
+            top = heapq.nlargest(3, _instrument_payments(instruments), key=itemgetter(1))
+            if top:
+                return [code for code, _ in top]
     except Exception:
-        print("pick_top_3_assets: error checking instruments:", traceback.format_exc())
+        logger.exception("pick_top_3_assets: error checking instruments")
 
     try:
         assets = list(qx.codes_asset.keys())
@@ -99,7 +163,133 @@ async def pick_top_3_assets(qx):
         return []
 
 
+def _latest_str_ts(candles, cutoff):
+    """Newest closed (ts, candle) when the feed keys candles by timestamp strings, or None."""
+    newest = max(((t, k) for k in candles if (t := int(k)) <= cutoff), default=None)
+    if newest is None:
+        return None
+    ts, key = newest
+    return ts, candles[key]
+
+
+def _latest_num_ts(candles, cutoff):
+    """Newest closed (ts, candle) when the feed keys candles by numeric timestamps, or None."""
+    ts = max((k for k in candles if k <= cutoff), default=None)
+    if ts is None:
+        return None
+    return ts, candles[ts]
+
+
+async def poll_candles(qx, assets, queue):
+    """
+    Poll realtime candles and put (asset, ts, candle) on `queue` when a new candle has closed.
+    Keeps the consumer idle between candles instead of re-processing unchanged data.
+    Wakes once per candle close; if an asset errors or its close is late, it is retried every
+    POLL_INTERVAL, at most LATE_RETRIES times per candle.
+    """
+    last_seen_ts = {}
+    latest_by_asset = {}  # per-asset lookup chosen from that feed's key type, see _latest_*_ts
+    warned = set()  # assets already reported as having an unusable candle format
+    # bind globals used every iteration as locals (LOAD_FAST instead of LOAD_GLOBAL)
+    timeframe = TIMEFRAME
+    poll_interval = POLL_INTERVAL
+    late_retries = LATE_RETRIES
+    wall_time = time.time
+    sleep = asyncio.sleep
+    current_candle = None
+    retries = 0
+
+    while True:
+        lagging = False
+        now = wall_time()
+        candle_index = int(now // timeframe)
+        if candle_index != current_candle:
+            current_candle, retries = candle_index, 0
+        # a candle opened at ts (seconds) is closed once ts + timeframe <= now
+        cutoff = now - timeframe
+        try:
+            # fetch all assets concurrently so round-trips overlap instead of adding up
+            results = await asyncio.gather(
+                *(qx.get_realtime_candles(asset) for asset in assets), return_exceptions=True
+            )
+            for asset, candles in zip(assets, results):
+                if isinstance(candles, Exception):
+                    # transient failure; log and retry
+                    logger.warning("get_realtime_candles error for %s: %r", asset, candles)
+                    lagging = True
+                    continue
+
+                if not candles:
+                    # idle stream; nothing to wait for
+                    continue
+
+                # candles expected as dict mapping timestamp -> candle dict;
+                # only the newest closed one matters, so take the max instead of sorting
+                try:
+                    latest = latest_by_asset.get(asset)
+                    if latest is None:
+                        latest = _latest_str_ts if isinstance(next(iter(candles)), str) else _latest_num_ts
+                        latest_by_asset[asset] = latest
+                    closed = latest(candles, cutoff)
+                    # seconds-based keys are never in the future; larger ones (e.g. ms) can never close
+                    bad_units = closed is None and any(float(k) > now for k in candles)
+                except Exception:
+                    closed, bad_units = None, False
+                    if asset not in warned:
+                        warned.add(asset)
+                        logger.warning("Unrecognized candle format for %s; skipping its candles", asset)
+                if bad_units and asset not in warned:
+                    warned.add(asset)
+                    logger.warning(
+                        "Candle timestamps for %s are ahead of the current time; expected candle-open "
+                        "times in seconds, so no candle will be treated as closed", asset
+                    )
+                if closed is None:
+                    # only the forming candle so far, or an unusable format
+                    lagging = True
+                    continue
+                ts_i, candle = closed
+
+                if last_seen_ts.get(asset) == ts_i:
+                    # the close has not been published yet (or the market is stalled)
+                    lagging = True
+                    continue
+                last_seen_ts[asset] = ts_i
+                queue.put_nowait((asset, ts_i, candle))
+        except Exception:
+            lagging = True
+            logger.exception("Candle poll error")
+
+        # Sleep until just after the next candle boundary (wall clock, since the broker
+        # aligns candles to it); the +0.5 s gives the broker time to publish the close.
+        delay = max(0.2, timeframe - (wall_time() % timeframe) + 0.5)
+        if lagging and retries < late_retries:
+            retries += 1
+            delay = min(delay, poll_interval)
+        await sleep(delay)
+
+
 async def monitor():
+    global _tg_session
+    # small keep-alive pool: one host, at most a few concurrent alerts in a burst
+    _tg_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=4),
+        timeout=aiohttp.ClientTimeout(total=10),
+    )
+    try:
+        await run_monitor()
+    finally:
+        # let in-flight alerts finish before the session goes away
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+        await _tg_session.close()
+        _tg_session = None
+
+
+async def run_monitor():
+    if TIMEFRAME <= 0:
+        print(f"ERROR: TIMEFRAME must be a positive number of seconds (got {TIMEFRAME}).")
+        return
+
     # Import any available Quotex client implementation
     try:
         from stable_api import Quotex  # prefer local stable_api if present
@@ -142,57 +332,61 @@ async def monitor():
             # not fatal; maybe client doesn't need explicit start
             pass
 
-    last_seen_ts = {}
-
-    while True:
-        try:
-            for asset in top_assets:
-                candles = None
-                try:
-                    candles = await qx.get_realtime_candles(asset)
-                except Exception as e:
-                    # transient failure; print and continue
-                    print(f"get_realtime_candles error for {asset}: {e}")
-
-                if not candles:
-                    continue
-
-                # candles expected as dict mapping timestamp -> candle dict
-                try:
-                    sorted_candles = sorted(candles.items(), key=lambda x: int(x[0]))
-                except Exception:
-                    # if format differs, skip
-                    continue
-
-                if not sorted_candles:
-                    continue
-
-                ts, candle = sorted_candles[-1]
-                if last_seen_ts.get(asset) == ts:
-                    continue
-                last_seen_ts[asset] = ts
+    # The client exposes no per-candle callback, so a light poller pushes only new candles
+    queue = asyncio.Queue()
+    poller = asyncio.create_task(poll_candles(qx, top_assets, queue))
+    # wake the consumer with a None sentinel if the poller ever stops, instead of waiting forever
+    poller.add_done_callback(lambda _: queue.put_nowait(None))
+
+    # bind globals used every iteration as locals (LOAD_FAST instead of LOAD_GLOBAL)
+    color_of = candle_color
+    send_alert = schedule_telegram
+    clock = _now
+    cooldown = COOLDOWN_SECONDS
+    colors = recent_colors
+    alerted = last_alert_time
+    sleep = asyncio.sleep
 
-                color = candle_color(candle)
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                logger.error("Candle poller stopped; exiting monitor")
+                poller.result()  # re-raise the poller's exception, if any
+                return
+            asset, ts, candle = item
+            try:
+                color = color_of(candle, asset)
                 if color == "doji":
                     continue
 
-                seq = recent_colors[asset]
-                seq.append(color)
-
-                if len(seq) == 4 and all(c == seq[0] for c in seq):
-                    now = time.time()
-                    if now - last_alert_time[asset] >= COOLDOWN_SECONDS:
-                        msg = f"🔔 {asset}: 4 closed candles in a row — {seq[0].upper()}\nLatest ts: {ts}"
+                last_color, streak = colors.get(asset, (None, 0))
+                if color != last_color:
+                    # common case: color flipped, the streak restarts and nothing can fire
+                    colors[asset] = (color, 1)
+                    continue
+                streak += 1
+                colors[asset] = (color, streak)
+
+                if streak >= 4:
+                    now = clock()
+                    # no alert yet means no cooldown: the clock's origin is undefined (boot time on Linux)
+                    last = alerted.get(asset)
+                    if last is None or now - last >= cooldown:
+                        msg = f"🔔 {asset}: 4 closed candles in a row — {color.upper()}\nLatest ts: {ts}"
                         print(msg)
-                        send_telegram(msg)
-                        last_alert_time[asset] = now
-        except Exception:
-            print("Main loop error:", traceback.format_exc())
-
-        await asyncio.sleep(POLL_INTERVAL)
+                        send_alert(msg)
+                        alerted[asset] = now
+                        # let the send task start before the next queued candle is handled
+                        await sleep(0)
+            except Exception:
+                logger.exception("Main loop error")
+    finally:
+        poller.cancel()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     try:
         asyncio.run(monitor())
     except KeyboardInterrupt: